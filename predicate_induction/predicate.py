@@ -1,4 +1,4 @@
-import pandas as pd
+import numpy as np
 from .data_type import Tabular
 
 class Predicate(object):
@@ -13,13 +13,18 @@ class Predicate(object):
     :type adjacent: dict
     """
 
+    __slots__ = ('keys', 'keys_tuple', 'keys_set', 'mask', 'score', 'upper_bound', 'adjacent', 'is_base', 'parents')
+
     allowed_dtypes_map = {}
     allowed_dtypes = ['nominal', 'ordinal', 'numeric']
 
     def __init__(self, keys, mask=None, score=None, adjacent=None, is_base=False, parents=None):
         self.keys = sorted(keys)
+        self.keys_tuple = tuple(self.keys)
+        self.keys_set = frozenset(self.keys)
         self.mask = mask
         self.score = score
+        self.upper_bound = None
         if adjacent is None:
             self.adjacent = {}
         else:
@@ -33,7 +38,7 @@ class Predicate(object):
         :param data: Data to return mask for
         :type data: pd.DataFrame
         :return: mask
-        :rtype: pd.Series
+        :rtype: np.array
         """
         
         raise NotImplementedError
@@ -44,7 +49,7 @@ class Predicate(object):
         :param data: Data to return mask for
         :type data: pd.DataFrame
         :return: mask
-        :rtype: pd.Series
+        :rtype: np.array
         """
 
         if self.mask is None:
@@ -81,6 +86,30 @@ class Predicate(object):
             self.score = self.get_score(data, score_f)
         return self.score
 
+    def get_upper_bound_cached(self, data, upper_bound_f):
+        """Return an upper bound on the score of any subset of this predicate. Get the cached results if available.
+
+        :param data: Data to get upper bound for
+        :type data: pd.DataFrame
+        :param upper_bound_f: Function used to calculate the upper bound given a mask
+        :type upper_bound_f: function
+        :return: upper bound
+        :rtype: float
+        """
+
+        if self.upper_bound is None:
+            self.upper_bound = upper_bound_f(self.get_mask_cached(data))
+        return self.upper_bound
+
+    def get_signature(self):
+        """Return a string identifying this predicate that is stable across runs.
+
+        :return: signature
+        :rtype: str
+        """
+
+        raise NotImplementedError
+
     def set_adjacent_predicate(self, key, predicate):
         """Set given predicate to be adjacent to this predicate along the axis of the given key.
 
@@ -141,6 +170,20 @@ class Predicate(object):
                 return False
         return True
 
+    def get_adjacent_all(self, keys=None):
+        """Get the set of predicates that are adjacent to this predicate along all axes.
+
+        :param keys: Axes along which predicates must be adjacent
+        :type keys: list
+        :return: Predicates adjacent along all axes
+        :rtype: set
+        """
+
+        if keys is None:
+            keys = self.keys
+        adjacent_sets = [set(self.adjacent.get(key, [])) for key in keys]
+        return set.intersection(*adjacent_sets) if len(adjacent_sets) > 0 else set()
+
     def is_worse(self, predicate, data, score_f):
         """Check if this predicate has a lower score than the given predicate.
 
@@ -155,11 +198,28 @@ class Predicate(object):
         :rtype: bool
         """
         
-        score = self.get_score(data , score_f)
-        predicate_score = predicate.get_score(data, score_f)
+        score = self.get_score_cached(data, score_f)
+        predicate_score = predicate.get_score_cached(data, score_f)
         worse = score <= predicate_score
         return worse
 
+    def is_subsumed(self, predicate, data, score_f, keys=None):
+        """Check if this predicate is contained by the given predicate and does not have a higher score.
+
+        :param predicate: Predicate of the same type that will be checked to see if it subsumes this predicate
+        :type predicate: Predicate
+        :param data: Data to get score for
+        :type data: pd.DataFrame
+        :param score_f: Function used to calculate score
+        :type score_f: function
+        :param keys: Check along this axis whether this predicate is contained
+        :type keys: list
+        :return: Whether or not this predicate is subsumed by the given predicate
+        :rtype: bool
+        """
+
+        return self.is_worse(predicate, data, score_f) and self.is_contained(predicate, keys)
+
     def is_contained_key(self, key, predicate):
         """Check if this predicate is contained by the given predicate along the given axis.
 
@@ -185,9 +245,12 @@ class Predicate(object):
         """
         
         if keys is None:
+            # a predicate can only contain this one if its keys are a subset of this predicate's keys
+            if not predicate.keys_set <= self.keys_set:
+                return False
             keys = predicate.keys
         for key in keys:
-            if key in predicate.keys:
+            if key in predicate.keys_set:
                 is_contained_key = self.is_contained_key(key, predicate)
             else:
                 is_contained_key = False
@@ -261,33 +324,45 @@ class Conjunction(Predicate):
     :type dtypes: dict
     :param data: Dataframe that this predicate will take a subset of 
     :type data: pd.DataFrame
-    :param column_to_mask: Dictionary mapping columns to a mask for each column, will be recalculated if None
+    :param column_to_mask: Dictionary mapping columns to a mask for each column packed with np.packbits, will be recalculated if None
     :type column_to_mask: dict
     :param mask: Returns subset when applied to data
-    :type mask: np.array, pd.Series
+    :type mask: np.array
     :param score: Dictionary of scores, any of which can be used during predicate induction
     :type score: dict
     :param adjacent: Dictionary mapping each key to a list of any adjacent predicates along that axis
     :type adjacent: dict
+    :param num_rows: Number of rows in the data, taken from mask or data if None and needed to unpack column_to_mask
+    :type num_rows: int
     """
 
+    __slots__ = ('columns', 'column_to_values', 'dtypes', 'column_to_mask', 'num_rows')
+
     allowed_dtypes_map = {'numeric': 'ordinal'}
     allowed_dtypes = ['nominal', 'ordinal']
     
-    def __init__(self, column_to_values, dtypes, data=None, column_to_mask=None, mask=None, score=None, adjacent=None, is_base=False, parents=None):
+    def __init__(self, column_to_values, dtypes, data=None, column_to_mask=None, mask=None, score=None, adjacent=None, is_base=False, parents=None, num_rows=None):
         self.columns = list(column_to_values.keys())
         super().__init__(self.columns, mask, score, adjacent, is_base, parents)
         self.column_to_values = column_to_values
         self.dtypes = dtypes
         self.column_to_mask = column_to_mask
+        if num_rows is None:
+            if self.mask is not None:
+                num_rows = len(self.mask)
+            elif data is not None:
+                num_rows = len(data)
+        self.num_rows = num_rows
         if self.mask is None:
             if self.column_to_mask is not None:
-                self.mask = self.get_mask_from_column_to_mask(column_to_mask)
+                if self.num_rows is None:
+                    raise ValueError("num_rows must not be None if column_to_mask is passed without data or mask")
+                self.mask = self.get_mask_from_column_to_mask(self.column_to_mask, self.num_rows)
             elif data is not None:
                 self.mask = self.get_mask(data, self.column_to_values)
 
     def get_column_to_mask(self, column_to_values, data):
-        """Return a mask for each column given a dictionary of columns to values.
+        """Return a mask for each column given a dictionary of columns to values. Masks are packed with np.packbits.
         
         :param columns_to_values: Dictionary of lists mapping columns in the data set to values defining a subset of the data
         :type column_to_values: dict
@@ -295,19 +370,22 @@ class Conjunction(Predicate):
         :type column_to_values: dict
         """
         
-        column_to_mask = pd.DataFrame()
+        column_to_mask = {}
         for column, values in column_to_values.items():
-            column_to_mask[column] = data[column].isin(values)
+            column_to_mask[column] = np.packbits(data[column].isin(values).to_numpy())
         return column_to_mask
 
-    def get_mask_from_column_to_mask(self, column_to_mask):
+    def get_mask_from_column_to_mask(self, column_to_mask, num_rows):
         """Return a mask from a dictionary mapping columns to masks.
         
-        :param column_to_mask: Dictionary mapping columns to a mask for each column
+        :param column_to_mask: Dictionary mapping columns to a mask for each column packed with np.packbits
         :type column_to_mask: dict
+        :param num_rows: Number of rows in the data
+        :type num_rows: int
         """
 
-        return column_to_mask.all(axis=1)
+        packed_mask = np.bitwise_and.reduce(list(column_to_mask.values()))
+        return np.unpackbits(packed_mask, count=num_rows).view(bool)
 
     def get_mask(self, data, column_to_values=None):
         """Return a mask from a dictionary mapping columns to values.
@@ -321,7 +399,7 @@ class Conjunction(Predicate):
                 raise ValueError("column_to_values must not be None if self.column_to_mask is None")
             else:
                 self.column_to_mask = self.get_column_to_mask(column_to_values, data)
-        return self.get_mask_from_column_to_mask(self.column_to_mask)
+        return self.get_mask_from_column_to_mask(self.column_to_mask, len(data))
 
     def is_contained_key(self, column, predicate):
         """Check if this predicate is contained by the given predicate along the given column.
@@ -333,7 +411,7 @@ class Conjunction(Predicate):
         :rtype: bool
         """
 
-        if column in self.columns and column in predicate.columns:
+        if column in self.keys_set and column in predicate.keys_set:
             return set(self.column_to_values[column]).issubset(predicate.column_to_values[column])
         else:
             return False
@@ -350,6 +428,7 @@ class Conjunction(Predicate):
         column_to_values = self.column_to_values.copy()
         column_to_mask = self.column_to_mask.copy()
         adjacent = self.adjacent.copy()
+        is_disjoint = True
         for column, values in predicate.column_to_values.items():
             if column not in column_to_values:
                 column_to_values[column] = values
@@ -357,14 +436,18 @@ class Conjunction(Predicate):
                 if column in adjacent:
                     adjacent[column] = [p for p in predicate.adjacent[column] if p != self]
             else:
+                is_disjoint = False
                 column_to_values[column] = list(set(values + column_to_values[column]))
                 column_to_mask[column] = column_to_mask[column] | predicate.column_to_mask[column]
                 if column in adjacent:
                     adjacent[column] = [p for p in self.adjacent[column] if not p.is_contained_key(column, predicate) and p not in predicate.adjacent[column]] \
                                     + [p for p in predicate.adjacent[column] if not p.is_contained_key(column, self) and p not in self.adjacent[column]]
 
-        mask = self.get_mask_from_column_to_mask(column_to_mask)
-        merged_predicate = Conjunction(column_to_values, self.dtypes, column_to_mask=column_to_mask, mask=mask, adjacent=adjacent, parents=[self, predicate])
+        if is_disjoint:
+            mask = self.mask & predicate.mask
+        else:
+            mask = self.get_mask_from_column_to_mask(column_to_mask, self.num_rows)
+        merged_predicate = Conjunction(column_to_values, self.dtypes, column_to_mask=column_to_mask, mask=mask, adjacent=adjacent, parents=[self, predicate], num_rows=self.num_rows)
         return merged_predicate
 
     @staticmethod
@@ -413,9 +496,21 @@ class Conjunction(Predicate):
             predicates += column_predicates
         return predicates
 
+    def get_signature(self):
+        """Return a string identifying this predicate that is stable across runs.
+
+        :return: Columns and sorted values as a string
+        :rtype: str
+        """
+
+        return repr([(column, sorted(self.column_to_values[column])) for column in self.keys])
+
     def __repr__(self):
         return str(self.column_to_values)
 
+    def __hash__(self):
+        return hash(frozenset((column, tuple(values)) for column, values in self.column_to_values.items()))
+
     def __eq__(self, other):
         if isinstance(other, Conjunction):
             return self.column_to_values == other.column_to_values
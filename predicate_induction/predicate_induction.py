@@ -1,5 +1,10 @@
+import hashlib
+import heapq
 import numpy as np
-from copy import deepcopy
+import pandas as pd
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque
+from itertools import chain, islice, takewhile
 
 class PredicateInduction(object):
     """Abstract class for predicate induction object.
@@ -7,39 +12,76 @@ class PredicateInduction(object):
     :param data: Data to search
     :param base_predicates: List of predicates to begin search
     :type base_predicates: list
-    :param score_f: Function used to score predicates
+    :param score_f: Function used to score predicates given a mask, may also provide score_f.score_batch to score a 2d array of masks at once and score_f.upper_bound to bound the score of any subset of a mask
     :type score_f: function
     :param frontier: List of predicates to continue search from, set to base_predicates if None
     :type frontier: list
-    :param accepted: List of predicates that have been accepted, set to [] if None
+    :param accepted: List of predicates that have been accepted, set to [] if None, kept sorted by descending score
     :type accepted: list
-    :param rejected: List of predicates that have been rejected, set to [] if None
+    :param rejected: List of predicates that have been rejected, set to [] if None, kept sorted by descending score
     :type rejected: list
     :param conditionally_accepted: List of predicates that have been conditionally accepted, set to [] if None
     :type conditionally_accepted: list
+    :param score_cache: Mapping used to reuse scores across runs, e.g. a shelve.Shelf, keyed by a fingerprint of the data, score_namespace and each predicate's signature, scores are not persisted if None
+    :type score_cache: dict
+    :param score_namespace: Name identifying score_f in score_cache keys, must differ between score functions sharing a score_cache
+    :type score_namespace: str
     """
 
-    def __init__(self, data, base_predicates, score_f, frontier=None, accepted=None, rejected=None, conditionally_accepted=None):
+    # upper limit on the size of the masks stacked for a single call to score_f.score_batch
+    score_batch_bytes = 2**26
+
+    def __init__(self, data, base_predicates, score_f, frontier=None, accepted=None, rejected=None, conditionally_accepted=None, score_cache=None, score_namespace=''):
         self.data = data
         self.base_predicates = base_predicates
         self.score_f = score_f
-        self.frontier = []
-        if frontier is None:
-            frontier = self.base_predicates
-        for p in frontier:
-            self.insert_sorted(self.frontier, p)
+        self.score_cache = score_cache
+        if score_cache is not None:
+            self.score_cache_prefix = '{}:{}:'.format(self.get_data_fingerprint(data), score_namespace)
         if accepted is None:
             self.accepted = []
         else:
-            self.accepted = accepted
+            self.accepted = sorted(accepted, key=lambda p: -self.get_predicate_score(p))
         if rejected is None:
             self.rejected = []
         else:
-            self.rejected = rejected
+            self.rejected = sorted(rejected, key=lambda p: -self.get_predicate_score(p))
         if conditionally_accepted is None:
             self.conditionally_accepted = []
         else:
             self.conditionally_accepted = conditionally_accepted
+        self.max_score = self.accepted[0].score if len(self.accepted) > 0 else -np.inf
+        self.frontier = []
+        if frontier is None:
+            frontier = self.base_predicates
+        self.get_predicate_scores(frontier)
+        for p in frontier:
+            self.insert_sorted(self.frontier, p)
+
+    def get_data_fingerprint(self, data):
+        """Return a hash of the data's columns and row values, in order, used to keep score_cache entries from being
+        reused on different data.
+
+        :param data: Data to fingerprint
+        :type data: pd.DataFrame
+        :return: fingerprint
+        :rtype: str
+        """
+
+        fingerprint = hashlib.sha1(repr(list(data.columns)).encode())
+        fingerprint.update(pd.util.hash_pandas_object(data).to_numpy().tobytes())
+        return fingerprint.hexdigest()
+
+    def get_score_cache_key(self, predicate):
+        """Return the key the given predicate's score is stored under in score_cache.
+
+        :param predicate: Predicate to get the key for
+        :type predicate: Predicate
+        :return: key
+        :rtype: str
+        """
+
+        return self.score_cache_prefix + predicate.get_signature()
 
     def get_predicate_score(self, predicate):
         """Return score for the given predicate
@@ -48,7 +90,62 @@ class PredicateInduction(object):
         :type predicate: Predicate
         """
 
-        return predicate.get_score_cached(self.data, self.score_f)
+        score = predicate.score
+        if score is None:
+            if self.score_cache is None:
+                score = predicate.get_score_cached(self.data, self.score_f)
+            else:
+                key = self.get_score_cache_key(predicate)
+                score = self.score_cache.get(key)
+                if score is None:
+                    score = predicate.get_score_cached(self.data, self.score_f)
+                    self.score_cache[key] = score
+                else:
+                    predicate.score = score
+        return score
+
+    def get_predicate_scores(self, predicates):
+        """Return scores for the given predicates. Predicates without a cached score are scored with score_f.score_batch
+        if it is available, in batches of get_score_batch_size() predicates so stacked masks stay under score_batch_bytes.
+
+        :param predicates: Predicates to score
+        :type predicates: list
+        :return: scores
+        :rtype: list
+        """
+
+        score_batch = getattr(self.score_f, 'score_batch', None)
+        if score_batch is not None:
+            unscored = []
+            for p in predicates:
+                if p.score is None:
+                    key = None
+                    if self.score_cache is not None:
+                        key = self.get_score_cache_key(p)
+                        p.score = self.score_cache.get(key)
+                    if p.score is None:
+                        unscored.append((p, key))
+            batch_size = self.get_score_batch_size()
+            for i in range(0, len(unscored), batch_size):
+                batch = unscored[i:i + batch_size]
+                masks = np.stack([np.asarray(p.get_mask_cached(self.data), dtype=bool) for p, key in batch])
+                for (p, key), score in zip(batch, score_batch(masks)):
+                    p.score = score
+                    if key is not None:
+                        self.score_cache[key] = score
+        return [self.get_predicate_score(p) for p in predicates]
+
+    def get_score_batch_size(self):
+        """Return the number of masks to stack for a single call to score_f.score_batch, so that a batch of masks takes
+        up at most score_batch_bytes. Predicates are scored one at a time if score_f.score_batch is not available.
+
+        :return: Number of predicates to score at once
+        :rtype: int
+        """
+
+        if getattr(self.score_f, 'score_batch', None) is None:
+            return 1
+        return max(1, self.score_batch_bytes // max(1, len(self.data)))
 
     def update_frontier(self, parent, children, verbose=False, tracked_predicates=None):
         """Update the frontier given a parent predicate and its children
@@ -60,61 +157,72 @@ class PredicateInduction(object):
         """
 
         is_done = True
-        if verbose and (tracked_predicates is None or parent in tracked_predicates):
+        track_parent = verbose and (tracked_predicates is None or parent in tracked_predicates)
+        if track_parent:
             children_added_to_frontier = []
             children_subsumed_by = []
         all_children_subsumed = len(children) > 0
+        parent_score = parent.score
         for child in children:
-            if child.score > parent.score:
-                is_subsumed = False
-                i = 0
-                while not is_subsumed and i < len(self.accepted):
-                    if child.is_contained(self.accepted[i]):
-                        if self.accepted[i].score > child.score:
-                            is_subsumed = True
-                            subsuming_keys = self.accepted[i].keys
-                    i+=1
-                if verbose and (tracked_predicates is None or parent in tracked_predicates):
-                    children_subsumed_by.append((child, self.accepted[i-1]))
-                if verbose and (tracked_predicates is None or child in tracked_predicates):
-                    if not is_subsumed:
-                        print(child, 'added to frontier')
-                    else:                            
-                        print(child, 'subsumed, NOT added to frontier')
-                if not is_subsumed:
-                    if verbose and (tracked_predicates is None or parent in tracked_predicates):
-                        children_added_to_frontier.append(child)
-                    is_done = False
-                    self.insert_sorted(self.frontier, child)
-                    all_children_subsumed = False
-                if is_subsumed and not any(key in subsuming_keys for key in parent.keys):
-                    all_children_subsumed = False
-            else:
+            child_score = child.score
+            if child_score <= parent_score:
+                all_children_subsumed = False
+                continue
+            higher_scoring = takewhile(lambda p: p.score > child_score, self.accepted)
+            subsuming = next((p for p in higher_scoring if child.is_contained(p)), None)
+            if subsuming is None:
+                if track_parent:
+                    children_added_to_frontier.append(child)
+                is_done = False
+                self.insert_sorted(self.frontier, child)
                 all_children_subsumed = False
-        if verbose and (tracked_predicates is None or parent in tracked_predicates):
+            else:
+                if track_parent:
+                    children_subsumed_by.append((child, subsuming))
+                if subsuming.keys_set.isdisjoint(parent.keys):
+                    all_children_subsumed = False
+            if verbose and (tracked_predicates is None or child in tracked_predicates):
+                if subsuming is None:
+                    print(child, 'added to frontier')
+                else:
+                    print(child, 'subsumed, NOT added to frontier')
+        if track_parent:
             print('children:', children_added_to_frontier, 'parent done:', is_done, 'children subsumed by:', children_subsumed_by, 'all children subsumed:', all_children_subsumed)
         return is_done, all_children_subsumed
 
     def insert_sorted(self, queue, predicate):
-        """Insert a predicate in sorted order
+        """Insert a predicate in sorted order, after any predicates with the same score.
 
-        :param queue: Where to insert the predicate
+        :param queue: Where to insert the predicate, sorted by descending score
         :type queue: list
         :param predicate: Predicate to insert
         :type predicate: Predicate
+        :return: Index the predicate was inserted at
+        :rtype: int
+        """
+
+        # every predicate already in a queue has been scored, so compare cached scores directly
+        score = self.get_predicate_score(predicate)
+        i = bisect_right(queue, -score, key=lambda p: -p.score)
+        queue.insert(i, predicate)
+        if score > self.max_score and (queue is self.frontier or queue is self.accepted):
+            self.max_score = score
+        return i
+
+    def index_sorted(self, queue, predicate):
+        """Find the index of a predicate in a queue sorted by descending score
+
+        :param queue: Where to look for the predicate, sorted by descending score
+        :type queue: list
+        :param predicate: Predicate to find
+        :type predicate: Predicate
+        :return: Index of the predicate
+        :rtype: int
         """
 
-        if len(queue) == 0:
-            queue.append(predicate)
-            return 1
         score = self.get_predicate_score(predicate)
-        for i in range(len(queue)):
-            i_score = self.get_predicate_score(queue[i])
-            if score > i_score:
-                queue.insert(i, predicate)
-                return i
-        queue.append(predicate)
-        return len(queue)
+        start = bisect_left(queue, -score, key=lambda p: -p.score)
+        return queue.index(predicate, start)
 
     def move_predicate(self, predicate, location, destination):
         """Move a predicate from one list to another
@@ -127,11 +235,12 @@ class PredicateInduction(object):
         :type destination: list
         """
 
-        location.remove(predicate)
+        del location[self.index_sorted(location, predicate)]
         self.insert_sorted(destination, predicate)
 
     def update_accepted_rejected_predicate(self, predicate, is_done, all_children_subsumed, threshold=0, verbose=False, tracked_predicates=None):
         """Either accept or reject the given predicate.
+
         :param predicate: Predicate to be either accepted or rejected
         :type predicate: Predicate
         :param is_done: Whether or not the given predicate is done generating new predicates:
@@ -142,42 +251,44 @@ class PredicateInduction(object):
         :type threshold: float
         """
 
-        if is_done:
-            if all_children_subsumed:
-                if verbose and (tracked_predicates is None or predicate in tracked_predicates):
-                    print(predicate, 'added to rejected')
-                self.insert_sorted(self.rejected, predicate)
-            else:
-                if predicate.score > threshold:
-                    is_subsuming = True
-                    contained_predicates = [p for p in self.accepted if p.is_contained(predicate)]
-                    i = 0
-                    while is_subsuming and i < len(contained_predicates):
-                        if predicate.score <= contained_predicates[i].score:
-                            self.insert_sorted(self.rejected, predicate)
-                            is_subsuming = False
-                        i+=1
-                    if is_subsuming and predicate.score > threshold:
-                        is_subsumed = False
-                        j = 0
-                        while predicate.is_base and not is_subsumed and j < len(self.accepted):
-                            if predicate.is_contained(self.accepted[j]) and predicate.score <= self.accepted[j].score:
-                                is_subsumed = True
-                            j+=1
-                        if not is_subsumed:
-                            self.insert_sorted(self.accepted, predicate)
-                            if verbose and (tracked_predicates is None or predicate in tracked_predicates):
-                                print(predicate, 'added to accepted')
-                        else:
-                            self.insert_sorted(self.rejected, predicate)
-                            if verbose and (tracked_predicates is None or predicate in tracked_predicates):
-                                print(predicate, 'subsumed; added to rejected')
-                        for contained_predicate in contained_predicates:
-                            if verbose and (tracked_predicates is None or contained_predicate in tracked_predicates):
-                                print(contained_predicate, 'moved to rejected')
-                            self.move_predicate(contained_predicate, self.accepted, self.rejected)
-                else:
-                    self.insert_sorted(self.rejected, predicate)
+        if not is_done:
+            return
+        if all_children_subsumed:
+            if verbose and (tracked_predicates is None or predicate in tracked_predicates):
+                print(predicate, 'added to rejected')
+            self.insert_sorted(self.rejected, predicate)
+        elif predicate.score > threshold:
+            self.update_accepted_predicate(predicate, verbose, tracked_predicates)
+        else:
+            self.insert_sorted(self.rejected, predicate)
+
+    def update_accepted_predicate(self, predicate, verbose=False, tracked_predicates=None):
+        """Accept the given predicate unless it is subsumed by an accepted predicate, and reject any accepted predicates
+        that it subsumes.
+
+        :param predicate: Predicate that is done generating new predicates and scores above threshold
+        :type predicate: Predicate
+        """
+
+        score = predicate.score
+        contained_predicates = [p for p in self.accepted if p.is_contained(predicate)]
+        if any(score <= p.score for p in contained_predicates):
+            self.insert_sorted(self.rejected, predicate)
+            return
+        track_predicate = verbose and (tracked_predicates is None or predicate in tracked_predicates)
+        higher_scoring = takewhile(lambda p: p.score >= score, self.accepted)
+        if predicate.is_base and any(predicate.is_contained(p) for p in higher_scoring):
+            self.insert_sorted(self.rejected, predicate)
+            if track_predicate:
+                print(predicate, 'subsumed; added to rejected')
+        else:
+            self.insert_sorted(self.accepted, predicate)
+            if track_predicate:
+                print(predicate, 'added to accepted')
+        for contained_predicate in contained_predicates:
+            if verbose and (tracked_predicates is None or contained_predicate in tracked_predicates):
+                print(contained_predicate, 'moved to rejected')
+            self.move_predicate(contained_predicate, self.accepted, self.rejected)
 
     def greedy_merge_predicate(self, keys, predicate, predicates, verbose=False, tracked_predicates=None):
         """Merge a given predicate with a list of other predicates.
@@ -189,23 +300,32 @@ class PredicateInduction(object):
         :param verbose: Option to print messages
         :type verbose: bool
         :return: The new predicate and remaining predicates
-        :rtype: (Predicate, [Predicate])
+        :rtype: (Predicate, deque)
         """
         
         score = self.get_predicate_score(predicate)
-        candidate_predicates = deepcopy(predicates)
-        for i in range(len(predicates)):
-            p = candidate_predicates[i]
-            if predicate.is_adjacent_all(p, keys):
-                merged_predicate = predicate.merge(p)
-                merged_score = self.get_predicate_score(merged_predicate)
-                if verbose and (predicate is None or predicate in tracked_predicates):
-                    print(predicate, score, p.score, merged_score)
-                if merged_score >= score:
-                    del predicates[i]
-                    return self.greedy_merge_predicate(keys, merged_predicate, predicates, verbose, tracked_predicates)
-            elif p.is_subsumed(predicate, self.data, self.score_f, keys=keys):
-                del predicates[i]
+        is_merged = True
+        while is_merged:
+            is_merged = False
+            adjacent_predicates = predicate.get_adjacent_all(keys)
+            track_predicate = verbose and (tracked_predicates is None or predicate in tracked_predicates)
+            remaining_predicates = deque()
+            for i, p in enumerate(predicates):
+                if p in adjacent_predicates:
+                    merged_predicate = predicate.merge(p)
+                    merged_score = self.get_predicate_score(merged_predicate)
+                    if track_predicate:
+                        print(predicate, score, p.score, merged_score)
+                    if merged_score >= score:
+                        predicate = merged_predicate
+                        score = merged_score
+                        remaining_predicates.extend(islice(predicates, i + 1, None))
+                        is_merged = True
+                        break
+                elif p.is_subsumed(predicate, self.data, self.score_f, keys=keys):
+                    continue
+                remaining_predicates.append(p)
+            predicates = remaining_predicates
         return predicate, predicates
 
     def greedy_merge(self, keys, predicates, threshold=0, verbose=False, tracked_predicates=None):
@@ -222,9 +342,10 @@ class PredicateInduction(object):
         """
 
         merged_predicates = []
+        predicates = deque(predicates)
         i = 0
         while len(predicates) > 0 and i < 100000:
-            predicate = predicates.pop(0)
+            predicate = predicates.popleft()
             if predicate.score > threshold:
                 predicate, predicates = self.greedy_merge_predicate(keys, predicate, predicates, verbose, tracked_predicates)
                 merged_predicates.append(predicate)
@@ -240,13 +361,9 @@ class PredicateInduction(object):
         :rtype: dict
         """
 
-        key_to_predicates = {}
+        key_to_predicates = defaultdict(list)
         for predicate in predicates:
-            key = tuple(predicate.keys)
-            if key in key_to_predicates:
-                key_to_predicates[key].append(predicate)
-            else:
-                key_to_predicates[key] = [predicate]
+            key_to_predicates[predicate.keys_tuple].append(predicate)
         return key_to_predicates
 
     def greedy_merge_frontier(self, threshold=0, verbose=False, tracked_predicates=None):
@@ -266,8 +383,8 @@ class PredicateInduction(object):
                 is_subsumed = False
                 i=0
                 while i < len(self.conditionally_accepted) and not is_subsumed:
-                    is_contained = predicate.is_contained_key(self.conditionally_accepted[i])
-                    if is_contained and self.conditionally_accepted[i] > predicate.score:
+                    is_contained = predicate.is_contained(self.conditionally_accepted[i])
+                    if is_contained and self.conditionally_accepted[i].score > predicate.score:
                         is_subsumed = True
                     i+=1
                 if not is_subsumed:
@@ -302,23 +419,36 @@ class PredicateInduction(object):
         :rtype: list
         """
 
-        merged_predicates = []
-        keep_a = [True for i in range(len(predicates_a))]
-        keep_b = [True for j in range(len(predicates_b))]
-        for i in range(len(predicates_a)):
-            for j in range(len(predicates_b)):
-                if predicates_a[i].is_contained(predicates_b[j]) or predicates_b[j].is_contained(predicates_a[i]):
-                    if predicates_a[i].score >= predicates_b[j].score:
+        keep_a = [True] * len(predicates_a)
+        keep_b = [True] * len(predicates_b)
+        scores_b = [self.get_predicate_score(b) for b in predicates_b]
+        # a predicate can only be contained by one whose keys are a subset of its own, so only pairs with nested
+        # keys need to be compared
+        keys_to_indices_b = defaultdict(list)
+        for j, b in enumerate(predicates_b):
+            keys_to_indices_b[b.keys_set].append(j)
+        keys_to_comparable_b = {}
+        for i, a in enumerate(predicates_a):
+            score_a = self.get_predicate_score(a)
+            if a.keys_set not in keys_to_comparable_b:
+                keys_to_comparable_b[a.keys_set] = [j for keys, indices in keys_to_indices_b.items() if keys <= a.keys_set or keys >= a.keys_set for j in indices]
+            for j in keys_to_comparable_b[a.keys_set]:
+                b = predicates_b[j]
+                # a contained pair only drops the lower scoring predicate, so skip pairs where it is already dropped
+                if score_a >= scores_b[j]:
+                    if not keep_b[j]:
+                        continue
+                elif not keep_a[i]:
+                    continue
+                if a.is_contained(b) or b.is_contained(a):
+                    if score_a >= scores_b[j]:
                         keep_b[j] = False
-                    elif predicates_b[j].score >= predicates_a[i].score:
+                    else:
                         keep_a[i] = False
-        for i in range(len(predicates_a)):
-            if keep_a[i]:
-                self.insert_sorted(merged_predicates, predicates_a[i])
-        for j in range(len(predicates_b)):
-            if keep_b[j]:
-                self.insert_sorted(merged_predicates, predicates_b[j])
-        return merged_predicates
+        sort_key = lambda p: -p.score
+        kept_a = sorted([a for a, keep in zip(predicates_a, keep_a) if keep], key=sort_key)
+        kept_b = sorted([b for b, keep in zip(predicates_b, keep_b) if keep], key=sort_key)
+        return list(heapq.merge(kept_a, kept_b, key=sort_key))
 
     def get_first_index(self, predicates=None):
         """Get the index of the first predicate that appears in the frontier out of a list of predicates.
@@ -332,7 +462,8 @@ class PredicateInduction(object):
         if predicates is None:
             first_index = 0
         else:
-            first_index = [self.frontier.index(predicate) for predicate in sorted(predicates, key=lambda x: x.score, reverse=True)][0]
+            first_predicate = max(predicates, key=lambda x: x.score)
+            first_index = self.index_sorted(self.frontier, first_predicate)
         return first_index
 
     def update_accepted_rejected_function(self, update_f, predicates=None, threshold=0, verbose=False, tracked_predicates=None):
@@ -347,7 +478,7 @@ class PredicateInduction(object):
         """
 
         first_index = self.get_first_index(predicates)
-        predicate = self.frontier.pop(first_index)            
+        predicate = self.frontier.pop(first_index)
         children = update_f(predicate, verbose, tracked_predicates)
         is_done, all_children_subsumed = self.update_frontier(predicate, children, verbose, tracked_predicates)
         self.update_accepted_rejected_predicate(predicate, is_done, all_children_subsumed, threshold, verbose, tracked_predicates)
@@ -366,13 +497,15 @@ class PredicateInduction(object):
         return merged_accepted
 
     def get_max_score(self):
-        """Get the maximum score of the predicate with the max score out of either the frontier or accepted.
+        """Get the maximum score of any predicate that has been added to either the frontier or accepted. Other than
+        predicates rejected for falling below threshold, a predicate only leaves both once one scoring at least as
+        high has been added, so this is also the maximum score out of either the frontier or accepted.
 
-        :return: Maximum score
+        :return: Maximum score, -inf if both are empty
         :rtype: float
         """
 
-        return max(self.frontier[0].score, self.accepted[0].score)
+        return self.max_score
 
     def get_predicates_maxiters(self, update_f, predicates=None, maxiters=None, threshold=0, conditional_threshold=None, verbose=False, tracked_predicates=None):
         """Generate new predicates using the given function for a given number of iterations or until the frontier is empty.
@@ -389,12 +522,16 @@ class PredicateInduction(object):
         :type conditional_threshold: float
         """
 
+        if tracked_predicates is not None:
+            try:
+                tracked_predicates = frozenset(tracked_predicates)
+            except TypeError:
+                # tracked predicates given as dicts are not hashable, so keep checking them in a list
+                pass
         i = 0
         while len(self.frontier) > 0 and (maxiters is None or i < maxiters):
-            if conditional_threshold is not None:
-                max_score = self.get_max_score()
-                if max_score > conditional_threshold:
-                    return self.get_predicates(conditional_threshold, verbose, tracked_predicates)
+            if conditional_threshold is not None and self.get_max_score() > conditional_threshold:
+                break
             self.update_accepted_rejected_function(update_f, predicates, threshold, verbose, tracked_predicates)
             i+=1
         return self.get_predicates(conditional_threshold, verbose, tracked_predicates)
@@ -408,24 +545,30 @@ class BottomUp(PredicateInduction):
     :param data: Data to search
     :param base_predicates: List of predicates to begin search
     :type base_predicates: list
-    :param score_f: Function used to score predicates
+    :param score_f: Function used to score predicates given a mask, may also provide score_f.score_batch to score a 2d array of masks at once and score_f.upper_bound to bound the score of any subset of a mask
     :type score_f: function
     :param frontier: List of predicates to continue search from, set to base_predicates if None
     :type frontier: list
-    :param accepted: List of predicates that have been accepted, set to [] if None
+    :param accepted: List of predicates that have been accepted, set to [] if None, kept sorted by descending score
     :type accepted: list
-    :param rejected: List of predicates that have been rejected, set to [] if None
+    :param rejected: List of predicates that have been rejected, set to [] if None, kept sorted by descending score
     :type rejected: list
     :param conditionally_accepted: List of predicates that have been conditionally accepted, set to [] if None
     :type conditionally_accepted: list
+    :param score_cache: Mapping used to reuse scores across runs, e.g. a shelve.Shelf, keyed by a fingerprint of the data, score_namespace and each predicate's signature, scores are not persisted if None
+    :type score_cache: dict
+    :param score_namespace: Name identifying score_f in score_cache keys, must differ between score functions sharing a score_cache
+    :type score_namespace: str
     """
 
-    def __init__(self, data, base_predicates, score_f, frontier=None, accepted=None, rejected=None, conditionally_accepted=None):
-        super().__init__(data, base_predicates, score_f, frontier, accepted, rejected, conditionally_accepted)
+    def __init__(self, data, base_predicates, score_f, frontier=None, accepted=None, rejected=None, conditionally_accepted=None, score_cache=None, score_namespace=''):
+        super().__init__(data, base_predicates, score_f, frontier, accepted, rejected, conditionally_accepted, score_cache, score_namespace)
         self.keys = list(set([p.keys[0] for p in self.base_predicates]))
-        self.key_to_base_predicates = {k:
-            [p for p in self.base_predicates if len(p.keys) == 1 and p.keys[0] == k]
-        for k in self.keys}
+        self.key_to_base_predicates = {k: [] for k in self.keys}
+        for p in self.base_predicates:
+            if len(p.keys) == 1:
+                self.key_to_base_predicates[p.keys[0]].append(p)
+        self.keys_to_refine_keys = {}
 
     def merge_predicate_candidates(self, predicate, candidate_predicates, verbose=False, tracked_predicates=None):
         """Merge the given predicate with a set of candidate predicates along a the given key.
@@ -446,14 +589,23 @@ class BottomUp(PredicateInduction):
             return []
         children = []
         score = self.get_predicate_score(predicate)
-        for candidate_predicate in candidate_predicates:
-            candidate_score = self.get_predicate_score(candidate_predicate)
-            merged_predicate = predicate.merge(candidate_predicate)
-            merged_score = self.get_predicate_score(merged_predicate)
-            if verbose and (tracked_predicates is None or predicate in tracked_predicates or merged_predicate in tracked_predicates):
-                print(predicate, candidate_predicate, merged_predicate, score, candidate_score, merged_score)
-            if merged_score > score:
-                children.append(merged_predicate)
+        upper_bound_f = getattr(self.score_f, 'upper_bound', None)
+        if upper_bound_f is not None:
+            # merging with a candidate over other keys only narrows it, so skip candidates that can not beat the score
+            candidate_predicates = [c for c in candidate_predicates if not (c.keys_set.isdisjoint(predicate.keys_set) and c.get_upper_bound_cached(self.data, upper_bound_f) <= score)]
+        track_predicate = verbose and (tracked_predicates is None or predicate in tracked_predicates)
+        # merge one batch at a time so only the merged predicates being scored hold masks that may be discarded
+        batch_size = self.get_score_batch_size()
+        for i in range(0, len(candidate_predicates), batch_size):
+            batch = candidate_predicates[i:i + batch_size]
+            merged_predicates = [predicate.merge(candidate_predicate) for candidate_predicate in batch]
+            merged_scores = self.get_predicate_scores(merged_predicates)
+            for candidate_predicate, merged_predicate, merged_score in zip(batch, merged_predicates, merged_scores):
+                candidate_score = self.get_predicate_score(candidate_predicate)
+                if track_predicate or (verbose and merged_predicate in tracked_predicates):
+                    print(predicate, candidate_predicate, merged_predicate, score, candidate_score, merged_score)
+                if merged_score > score:
+                    children.append(merged_predicate)
         return children
 
     def refine_predicate_key(self, predicate, key, verbose=False, tracked_predicates=None):
@@ -503,7 +655,22 @@ class BottomUp(PredicateInduction):
         :rtype: list
         """
 
-        return [a for b in [f(predicate, key, verbose, tracked_predicates) for key in keys] for a in b]
+        return list(chain.from_iterable(f(predicate, key, verbose, tracked_predicates) for key in keys))
+
+    def get_refine_keys(self, predicate):
+        """Get the keys that the given predicate does not already include. Get the cached results if available.
+
+        :param predicate: Predicate that will be refined
+        :type predicate: Predicate
+        :return: Keys not included in the predicate
+        :rtype: list
+        """
+
+        refine_keys = self.keys_to_refine_keys.get(predicate.keys_tuple)
+        if refine_keys is None:
+            refine_keys = [key for key in self.keys if key not in predicate.keys_set]
+            self.keys_to_refine_keys[predicate.keys_tuple] = refine_keys
+        return refine_keys
 
     def refine_predicate(self, predicate, verbose=False, tracked_predicates=None):
         """Refine the given predicate by adding additional keys that the predicate does not already include.
@@ -516,7 +683,7 @@ class BottomUp(PredicateInduction):
         :rtype: list
         """
 
-        return self.apply_all_keys(predicate, [key for key in self.keys if key not in predicate.keys], self.refine_predicate_key, verbose, tracked_predicates)
+        return self.apply_all_keys(predicate, self.get_refine_keys(predicate), self.refine_predicate_key, verbose, tracked_predicates)
 
     def expand_predicate(self, predicate, verbose=False, tracked_predicates=None):
         """Expand the given predicate by merging with adjacent predicates along all keys.
@@ -532,7 +699,7 @@ class BottomUp(PredicateInduction):
         return self.apply_all_keys(predicate, predicate.keys, self.expand_predicate_key, verbose, tracked_predicates)
     
     def expand_refine_predicate(self, predicate, verbose=False, tracked_predicates=None):
-        """Refine and expand a given predicate.
+        """Refine and expand a given predicate. Candidates from expanding and refining are merged in a single pass.
 
         :param predicate: Predicate that will be refined and expanded
         :type predicate: Predicate
@@ -542,7 +709,10 @@ class BottomUp(PredicateInduction):
         :rtype: list
         """
 
-        return self.expand_predicate(predicate, verbose, tracked_predicates) + self.refine_predicate(predicate, verbose, tracked_predicates)
+        expand_candidates = chain.from_iterable(predicate.adjacent.get(key, []) for key in predicate.keys)
+        refine_candidates = chain.from_iterable(self.key_to_base_predicates[key] for key in self.get_refine_keys(predicate))
+        candidate_predicates = list(chain(expand_candidates, refine_candidates))
+        return self.merge_predicate_candidates(predicate, candidate_predicates, verbose, tracked_predicates)
 
     def expand(self, predicates=None, maxiters=None, threshold=0, conditional_threshold=None, verbose=False, tracked_predicates=None):
         """Generate new predicates by expanding for a given number of iterations or until the frontier is empty.
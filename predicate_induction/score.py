@@ -0,0 +1,158 @@
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+def deviation(values, mean, mask):
+    """Sum the deviation from the mean of all values included in the mask.
+
+    :param values: Values to score
+    :type values: np.array
+    :param mean: Mean of all values
+    :type mean: float
+    :param mask: Boolean mask over values
+    :type mask: np.array
+    :return: score
+    :rtype: float
+    """
+
+    return (values[mask] - mean).sum()
+
+def deviation_batch(values, mean, masks):
+    """Sum the deviation from the mean of all values included in each row of a 2d array of masks. Each row is reduced
+    with deviation so a mask gets exactly the same score in a batch as on its own.
+
+    :param values: Values to score
+    :type values: np.array
+    :param mean: Mean of all values
+    :type mean: float
+    :param masks: 2d boolean array with one mask over values per row
+    :type masks: np.array
+    :return: scores
+    :rtype: np.array
+    """
+
+    return np.array([deviation(values, mean, mask) for mask in masks], dtype=np.float64)
+
+def positive_deviation(values, mean, mask):
+    """Sum the positive deviations from the mean of all values included in the mask.
+
+    :param values: Values to score
+    :type values: np.array
+    :param mean: Mean of all values
+    :type mean: float
+    :param mask: Boolean mask over values
+    :type mask: np.array
+    :return: upper bound
+    :rtype: float
+    """
+
+    return np.maximum(values[mask] - mean, 0).sum()
+
+# Compiled loops replace the numpy versions above when numba is installed
+if njit is not None:
+    # fastmath is left off so sums are never reordered, batch and single scores tie exactly and bounds never undercut scores
+    @njit(cache=True)
+    def deviation(values, mean, mask):
+        total = 0.0
+        for i in range(values.shape[0]):
+            if mask[i]:
+                total += values[i] - mean
+        return total
+
+    @njit(cache=True)
+    def positive_deviation(values, mean, mask):
+        total = 0.0
+        for i in range(values.shape[0]):
+            if mask[i] and values[i] > mean:
+                total += values[i] - mean
+        return total
+
+    @njit(cache=True, parallel=True)
+    def deviation_batch(values, mean, masks):
+        scores = np.empty(masks.shape[0])
+        for j in prange(masks.shape[0]):
+            scores[j] = deviation(values, mean, masks[j])
+        return scores
+
+class Score(object):
+    """Abstract class for score functions that can be passed to predicate induction as score_f. Subclasses may also
+    define upper_bound(mask), returning a bound on the score of any subset of the mask, to let predicate induction skip
+    merges that can not improve a predicate.
+
+    :param values: Values that predicates are scored against, one per row of the data
+    :type values: np.array, pd.Series
+    """
+
+    def __init__(self, values):
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+
+    def __call__(self, mask):
+        """Return the score of the subset selected by the given mask.
+
+        :param mask: Boolean mask over the data
+        :type mask: np.array, pd.Series
+        :return: score
+        :rtype: float
+        """
+
+        raise NotImplementedError
+
+    def score_batch(self, masks):
+        """Return the scores of the subsets selected by each row of a 2d array of masks.
+
+        :param masks: 2d boolean array with one mask over the data per row
+        :type masks: np.array
+        :return: scores
+        :rtype: np.array
+        """
+
+        return np.array([self(mask) for mask in masks])
+
+class Deviation(Score):
+    """Score subsets by the total deviation of their values from the mean of all values. Subsets whose values are
+    consistently above the mean score highest. Scoring is compiled with numba if it is installed.
+
+    :param values: Values that predicates are scored against, one per row of the data
+    :type values: np.array, pd.Series
+    """
+
+    def __init__(self, values):
+        super().__init__(values)
+        self.mean = self.values.mean()
+
+    def __call__(self, mask):
+        """Return the total deviation from the mean of the values selected by the given mask.
+
+        :param mask: Boolean mask over the data
+        :type mask: np.array, pd.Series
+        :return: score
+        :rtype: float
+        """
+
+        return float(deviation(self.values, self.mean, np.asarray(mask, dtype=np.bool_)))
+
+    def score_batch(self, masks):
+        """Return the total deviation from the mean of the values selected by each row of a 2d array of masks.
+
+        :param masks: 2d boolean array with one mask over the data per row
+        :type masks: np.array
+        :return: scores
+        :rtype: np.array
+        """
+
+        return deviation_batch(self.values, self.mean, np.ascontiguousarray(masks, dtype=np.bool_))
+
+    def upper_bound(self, mask):
+        """Return the total positive deviation from the mean of the values selected by the given mask, which no subset
+        of the mask can score above.
+
+        :param mask: Boolean mask over the data
+        :type mask: np.array, pd.Series
+        :return: upper bound
+        :rtype: float
+        """
+
+        return float(positive_deviation(self.values, self.mean, np.asarray(mask, dtype=np.bool_)))
@@ -4,6 +4,7 @@ setup(
     name='predicate_induction',
     version='0.2.1',
     packages=['predicate_induction'],
+    python_requires='>=3.10',
     install_requires=[
     ],
 )
\ No newline at end of file